@@ -1,11 +1,30 @@
-import praw
-import google.generativeai as genai
-import pandas as pd
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncpraw
+import asyncprawcore
+from contextlib import asynccontextmanager
+import csv
+import functools
+import heapq
+import operator
 from datetime import datetime, timedelta
 import time
 import os
+import re
+import sqlite3
+import threading
 from dotenv import load_dotenv
 
+try:
+    import ahocorasick
+except ImportError:  # Fall back to token-set matching below
+    ahocorasick = None
+
+try:
+    import orjson
+except ImportError:  # Reddit responses are decoded with the stdlib json module
+    orjson = None
+
 # Load environment variables
 load_dotenv()
 
@@ -21,6 +40,22 @@ REDDIT_CONFIG = {
 # Gemini API Key (loaded from .env file)
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
+# Gemini model used for message generation
+GEMINI_MODEL = "gemini-2.5-flash"
+
+# Message generation: leads per Gemini batch, total messages per run, and the
+# priority score at which a lead is sent to Gemini before scraping finishes.
+# EAGER_PRIORITY is the maximum score, so no later lead can outrank an eager one
+# and the run still messages the top MAX_MESSAGES leads by score. Eager leads
+# are sent once BATCH_SIZE are waiting or the oldest has waited EAGER_FLUSH_SECONDS
+BATCH_SIZE = 8
+MAX_MESSAGES = 15
+EAGER_PRIORITY = 10
+EAGER_FLUSH_SECONDS = 2
+
+# Gemini requests per minute allowed by your API quota
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "60"))
+
 # Target Subreddits (Customize based on your geography)
 TARGET_SUBREDDITS = [
     "tutoring",
@@ -58,6 +93,33 @@ GRADE_KEYWORDS = {
     "high": ["year 10", "year 11", "year 12", "year 13", "a-level", "a level", "high school", "igcse", "ib", "grade 9", "grade 10", "grade 11", "grade 12"]
 }
 
+# Urgency, parent, and payment signals
+URGENCY_KEYWORDS = ["urgent", "asap", "exam tomorrow", "test tomorrow", "due tomorrow", "help now", "need help now"]
+PARENT_KEYWORDS = ["my son", "my daughter", "my child", "my kid", "my children"]
+PAYMENT_KEYWORDS = ["pay", "rate", "price", "cost", "budget", "hourly", "per hour"]
+
+# Math Topic Keywords
+TOPIC_KEYWORDS = {
+    "algebra": ["algebra", "equation", "variable", "expression", "quadratic"],
+    "calculus": ["calculus", "derivative", "integral", "limit", "differentiation"],
+    "geometry": ["geometry", "triangle", "circle", "angle", "polygon"],
+    "trigonometry": ["trigonometry", "sine", "cosine", "trig", "tan"],
+    "statistics": ["statistics", "probability", "mean", "median", "data"],
+    "arithmetic": ["addition", "subtraction", "multiplication", "division", "fractions", "decimals"]
+}
+
+# Local database of already-processed post IDs
+PROCESSED_DB = "processed_leads.db"
+LEGACY_PROCESSED_CSV = "processed_leads.csv"  # Imported into PROCESSED_DB once
+
+# Terminal states of a Gemini batch job
+BATCH_DONE_STATES = {
+    "JOB_STATE_SUCCEEDED",
+    "JOB_STATE_FAILED",
+    "JOB_STATE_CANCELLED",
+    "JOB_STATE_EXPIRED",
+}
+
 # Your Tutor Profile (CUSTOMIZE THIS!)
 TUTOR_PROFILE = """
 - 2 years of online mathematics tutoring experience
@@ -69,144 +131,287 @@ TUTOR_PROFILE = """
 - Book trial: [YOUR CALENDLY LINK or WhatsApp: +91-XXXXXXXXXX]
 """
 
+# Standing instructions for Gemini, sent once as the system instruction
+SYSTEM_INSTRUCTION = """
+You are a professional mathematics tutor replying to a Reddit post. Write a
+personalized, conversational Reddit comment of 150-200 words that:
+- references specific details from the post (quote a phrase if relevant)
+- offers one helpful tip or insight on their problem
+- is friendly and supportive, matched to a parent or a student
+- mentions your tutoring experience naturally, without sounding salesy
+- offers a free 20-minute trial session and ends with a simple call-to-action (DM or reply)
+Be helpful first, promotional second. No templated or formal language; use
+Reddit-style formatting, no emojis unless natural. Output ONLY the message.
+"""
+
+# ==================== KEYWORD MATCHING ====================
+
+# Search keywords as one case-insensitive pattern, run on the raw post text
+KEYWORDS_RE = re.compile("|".join(map(re.escape, KEYWORDS)), re.IGNORECASE)
+
+# Every other keyword group, keyed by the category it flags on a post
+KEYWORD_CATEGORIES = {
+    "urgent": URGENCY_KEYWORDS,
+    "parent": PARENT_KEYWORDS,
+    "payment": PAYMENT_KEYWORDS,
+    **GRADE_KEYWORDS,
+    **TOPIC_KEYWORDS,
+}
+
+# Without pyahocorasick: one compiled alternation per category, with the same
+# substring semantics as the automaton. A per-token {keyword: category} index
+# would be cheaper but only matches whole words ("equations" would miss
+# "equation"), so scores would depend on whether pyahocorasick is installed
+CATEGORY_PATTERNS = {
+    category: re.compile("|".join(re.escape(k.lower()) for k in keywords))
+    for category, keywords in KEYWORD_CATEGORIES.items()
+}
+
+# One automaton over all keywords so each post is scanned exactly once
+KEYWORD_AUTOMATON = None
+if ahocorasick is not None:
+    KEYWORD_AUTOMATON = ahocorasick.Automaton()
+    for category, keywords in KEYWORD_CATEGORIES.items():
+        for keyword in keywords:
+            KEYWORD_AUTOMATON.add_word(keyword.lower(), (category, keyword))
+    KEYWORD_AUTOMATON.make_automaton()
+
+
+def match_categories(text):
+    """Return the set of keyword categories found in lowercased text"""
+    if KEYWORD_AUTOMATON is not None:
+        return {category for _, (category, _) in KEYWORD_AUTOMATON.iter(text)}
+
+    return {category for category, pattern in CATEGORY_PATTERNS.items() if pattern.search(text)}
+
 # ==================== REDDIT SCRAPER ====================
 
+PERMALINK_FMT = "https://reddit.com{}".format
+CREATED_FMT = "%Y-%m-%d %H:%M"
+
+class OrjsonRequestor(asyncprawcore.Requestor):
+    """Requestor that decodes Reddit's JSON responses with orjson"""
+
+    @asynccontextmanager
+    async def request(self, *args, **kwargs):
+        async with super().request(*args, **kwargs) as response:
+            response.json = functools.partial(response.json, loads=orjson.loads)
+            yield response
+
 class RedditLeadFinder:
     def __init__(self):
-        self.reddit = praw.Reddit(**REDDIT_CONFIG)
         self.leads = []
+        self.new_ids = []
+        self._author_cache = {}
+        self._sub_cache = {}
+        self.db = sqlite3.connect(PROCESSED_DB)
         self.processed_ids = self.load_processed_ids()
+        self.cursors = self.load_cursors()
 
     def load_processed_ids(self):
         """Load previously processed post IDs to avoid duplicates"""
+        self.db.execute("CREATE TABLE IF NOT EXISTS processed (post_id TEXT PRIMARY KEY)")
+        self.import_legacy_ids()
+        return set(row[0] for row in self.db.execute("SELECT post_id FROM processed"))
+
+    def import_legacy_ids(self):
+        """Move IDs from the old processed_leads.csv into the database"""
         try:
-            df = pd.read_csv('processed_leads.csv')
-            return set(df['post_id'].tolist())
+            with open(LEGACY_PROCESSED_CSV, newline='', encoding='utf-8') as f:
+                rows = [(row['post_id'],) for row in csv.DictReader(f)]
         except FileNotFoundError:
-            return set()
-
-    def search_posts(self, hours_back=24):
-        """Search for relevant tutoring posts in last X hours"""
+            return
+
+        self.db.executemany("INSERT OR IGNORE INTO processed (post_id) VALUES (?)", rows)
+        self.db.commit()
+        os.rename(LEGACY_PROCESSED_CSV, LEGACY_PROCESSED_CSV + ".imported")
+
+    def save_processed_ids(self):
+        """Record post IDs found in this run (append-only)"""
+        self.db.executemany(
+            "INSERT OR IGNORE INTO processed (post_id) VALUES (?)",
+            [(post_id,) for post_id in self.new_ids],
+        )
+        self.db.commit()
+
+    def load_cursors(self):
+        """Load the newest post (fullname, created_utc) seen in each listing on earlier runs"""
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS listing_cursors "
+            "(listing TEXT PRIMARY KEY, last_fullname TEXT, last_created REAL)"
+        )
+        rows = self.db.execute("SELECT listing, last_fullname, last_created FROM listing_cursors")
+        return {listing: (fullname, created) for listing, fullname, created in rows}
+
+    def save_cursors(self):
+        """Record the newest post seen in each listing"""
+        self.db.executemany(
+            "INSERT OR REPLACE INTO listing_cursors (listing, last_fullname, last_created) VALUES (?, ?, ?)",
+            [(listing, fullname, created) for listing, (fullname, created) in self.cursors.items()],
+        )
+        self.db.commit()
+
+    def _author_name(self, post):
+        """Resolve a post's author name once per unique author"""
+        fullname = getattr(post, "author_fullname", None)
+        if fullname in self._author_cache:
+            return self._author_cache[fullname]
+
+        author = post.author
+        name = author.name if author else "[deleted]"
+        if fullname is not None:
+            self._author_cache[fullname] = name
+        return name
+
+    def _subreddit_name(self, post):
+        """Resolve a post's subreddit name once per unique subreddit"""
+        sub_id = post.subreddit_id
+        if sub_id not in self._sub_cache:
+            self._sub_cache[sub_id] = post.subreddit.display_name
+        return self._sub_cache[sub_id]
+
+    async def search_posts(self, hours_back=24):
+        """Search for relevant tutoring posts in last X hours, yielding leads as they're found"""
         print(f"🔍 Searching posts from last {hours_back} hours...\n")
 
         cutoff_time = datetime.now() - timedelta(hours=hours_back)
 
-        for subreddit_name in TARGET_SUBREDDITS:
+        # One multireddit listing (r/a+b+c/new) covers every target subreddit
+        combined_name = "+".join(TARGET_SUBREDDITS)
+
+        requestor_class = OrjsonRequestor if orjson is not None else None
+        async with asyncpraw.Reddit(**REDDIT_CONFIG, requestor_class=requestor_class) as reddit:
+            reddit.read_only = True
+
             try:
-                subreddit = self.reddit.subreddit(subreddit_name)
+                combined = await reddit.subreddit(combined_name)
 
-                # Search new posts
-                for post in subreddit.new(limit=50):
-                    # Skip already processed posts
-                    if post.id in self.processed_ids:
-                        continue
+                # The last run's newest post; everything from there on was already scanned
+                last_fullname, last_created = self.cursors.get(combined_name, (None, None))
+                newest = None
+
+                # Search new posts; no fixed cap, so busy subreddits can't crowd out
+                # quiet ones -- the cursor and cutoff checks below end the scan
+                async for post in combined.new(limit=None):
+                    # Listings are newest first
+                    if newest is None:
+                        newest = (post.name, post.created_utc)
+
+                    if post.name == last_fullname or (last_created is not None and post.created_utc <= last_created):
+                        break
 
                     post_time = datetime.fromtimestamp(post.created_utc)
 
+                    # Everything after this post is older too; stop paging
                     if post_time < cutoff_time:
-                        continue
+                        break
 
-                    # Check if post matches keywords
-                    post_text = (post.title + " " + post.selftext).lower()
+                    # Skip already processed posts
+                    if post.id in self.processed_ids:
+                        continue
 
-                    if any(keyword in post_text for keyword in KEYWORDS):
-                        lead_data = self.extract_lead_data(post)
-                        if lead_data:
-                            self.leads.append(lead_data)
-                            self.processed_ids.add(post.id)
-                            print(f"✅ Found lead: {post.title[:60]}...")
+                    # Keep posts that match the search keywords
+                    lead_data, hits = self.extract_lead_data(post, post_time)
+                    if lead_data:
+                        lead_data['priority_score'] = score_lead(lead_data, hits)
+                        self.leads.append(lead_data)
+                        self.processed_ids.add(post.id)
+                        self.new_ids.append(post.id)
+                        print(f"✅ Found lead: {post.title[:60]}...")
+                        yield lead_data
 
-                time.sleep(2)  # Rate limiting
+                if newest:
+                    self.cursors[combined_name] = newest
 
             except Exception as e:
-                print(f"⚠️  Error in r/{subreddit_name}: {str(e)}")
+                print(f"⚠️  Error in r/{combined_name}: {str(e)}")
 
         print(f"\n📊 Total NEW leads found: {len(self.leads)}\n")
-        return self.leads
 
-    def extract_lead_data(self, post):
-        """Extract relevant information from post"""
-        post_text = (post.title + " " + post.selftext).lower()
+    def extract_lead_data(self, post, post_time):
+        """Extract relevant information and keyword hits from post (lead is None if no match)"""
+        raw_text = post.title + " " + post.selftext
 
-        # Determine grade level
-        grade_level = self.detect_grade_level(post_text)
+        # Most posts don't match; reject them before making a lowercased copy
+        if not KEYWORDS_RE.search(raw_text):
+            return None, set()
 
-        # Detect urgency
-        urgency_keywords = ["urgent", "asap", "exam tomorrow", "test tomorrow", "due tomorrow", "help now", "need help now"]
-        is_urgent = any(keyword in post_text for keyword in urgency_keywords)
+        hits = match_categories(raw_text.casefold())
 
-        # Detect if parent or student
-        is_parent = any(word in post_text for word in ["my son", "my daughter", "my child", "my kid", "my children"])
+        # Determine grade level (first matching level wins)
+        grade_level = next((level for level in GRADE_KEYWORDS if level in hits), "unknown")
 
         # Extract topics mentioned
-        topics = self.extract_topics(post_text)
+        topics = [topic for topic in TOPIC_KEYWORDS if topic in hits] or ["general mathematics"]
 
-        # Check if they mention budget/payment
-        mentions_payment = any(word in post_text for word in ["pay", "rate", "price", "cost", "budget", "hourly", "per hour"])
-
-        return {
+        lead = {
             "post_id": post.id,
-            "subreddit": post.subreddit.display_name,
+            "subreddit": self._subreddit_name(post),
             "title": post.title,
             "content": post.selftext,
-            "author": str(post.author),
-            "url": f"https://reddit.com{post.permalink}",
-            "created_utc": datetime.fromtimestamp(post.created_utc).strftime("%Y-%m-%d %H:%M"),
+            "author": self._author_name(post),
+            "url": PERMALINK_FMT(post.permalink),
+            "created_utc": post_time.strftime(CREATED_FMT),
             "grade_level": grade_level,
-            "is_urgent": is_urgent,
-            "is_parent": is_parent,
+            "is_urgent": "urgent" in hits,
+            "is_parent": "parent" in hits,
             "topics": ", ".join(topics),
-            "mentions_payment": mentions_payment,
+            "mentions_payment": "payment" in hits,
             "score": post.score,
             "num_comments": post.num_comments,
-            "priority_score": 0,  # Will be calculated later
+            "priority_score": 0,  # Scored by the caller from the keyword hits
             "generated_message": "",
             "status": "New",
             "response_received": "No",
             "notes": ""
         }
+        return lead, hits
 
-    def detect_grade_level(self, text):
-        """Detect student grade level from post"""
-        for level, keywords in GRADE_KEYWORDS.items():
-            if any(keyword in text for keyword in keywords):
-                return level
-        return "unknown"
-
-    def extract_topics(self, text):
-        """Extract specific math topics mentioned"""
-        topics = []
-        topic_keywords = {
-            "algebra": ["algebra", "equation", "variable", "expression", "quadratic"],
-            "calculus": ["calculus", "derivative", "integral", "limit", "differentiation"],
-            "geometry": ["geometry", "triangle", "circle", "angle", "polygon"],
-            "trigonometry": ["trigonometry", "sine", "cosine", "trig", "tan"],
-            "statistics": ["statistics", "probability", "mean", "median", "data"],
-            "arithmetic": ["addition", "subtraction", "multiplication", "division", "fractions", "decimals"]
-        }
+# ==================== GEMINI PERSONALIZATION ====================
 
-        for topic, keywords in topic_keywords.items():
-            if any(keyword in text for keyword in keywords):
-                topics.append(topic)
+class RateLimiter:
+    """Thread-safe limiter that spaces calls evenly to stay under a per-minute quota"""
 
-        return topics if topics else ["general mathematics"]
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
 
-# ==================== GEMINI PERSONALIZATION ====================
+    def wait(self):
+        """Block until the caller's slot comes up"""
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        time.sleep(slot - now)
 
 class GeminiMessageGenerator:
     def __init__(self, api_key):
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-pro')
-
-    def generate_personalized_message(self, lead_data):
-        """Generate personalized outreach message using Gemini"""
-
-        prompt = f"""
-You are a professional mathematics tutor writing a personalized, helpful response to a Reddit post.
-
-TUTOR PROFILE:
-{TUTOR_PROFILE}
-
+        # Imported here so runs that find no leads skip the SDK's slow import
+        from google import genai
+        from google.genai import types
+
+        self.client = genai.Client(api_key=api_key)
+        self.rate_limiter = RateLimiter(GEMINI_RPM)
+
+        # The static prefix (instructions + profile) goes in the system instruction,
+        # which 2.5 models cache implicitly; each call only sends the post details
+        generation = dict(
+            system_instruction=f"{SYSTEM_INSTRUCTION}\nTUTOR PROFILE:\n{TUTOR_PROFILE}",
+            max_output_tokens=300,
+            temperature=0.7,
+            candidate_count=1,
+            # Short replies don't need thinking tokens, which also count against max_output_tokens
+            thinking_config=types.ThinkingConfig(thinking_budget=0),
+        )
+        # Batch jobs are already billed at the discounted rate
+        self.batch_config = types.GenerateContentConfig(**generation)
+        # Per-lead calls are background work too; the flex tier halves their cost
+        self.config = types.GenerateContentConfig(service_tier=types.ServiceTier.FLEX, **generation)
+
+    def build_prompt(self, lead_data):
+        """Build the per-lead part of the Gemini prompt"""
+        return f"""
 POST DETAILS:
 - Subreddit: r/{lead_data['subreddit']}
 - Title: {lead_data['title']}
@@ -215,58 +420,182 @@ POST DETAILS:
 - Urgent: {lead_data['is_urgent']}
 - Posted by: {"Parent" if lead_data['is_parent'] else "Student"}
 - Topics: {lead_data['topics']}
-
-INSTRUCTIONS:
-1. Write a personalized, conversational Reddit comment (150-200 words)
-2. Reference specific details from their post (quote a phrase if relevant)
-3. Demonstrate expertise by offering one helpful tip or insight related to their problem
-4. Keep tone friendly and supportive (match whether parent or student)
-5. Mention your tutoring experience naturally (don't sound salesy)
-6. Offer a free 20-minute trial session
-7. End with a simple call-to-action (DM for details or reply)
-8. DO NOT sound templated or robotic
-9. DO NOT use overly formal language - be conversational
-10. Make it feel genuinely helpful first, promotional second
-11. Use Reddit-style formatting (no emojis unless natural)
-
-Generate ONLY the message, no additional commentary:
 """
 
+    def generate_personalized_message(self, lead_data):
+        """Generate personalized outreach message using Gemini"""
+        prompt = self.build_prompt(lead_data)
+        self.rate_limiter.wait()
+
         try:
-            response = self.model.generate_content(prompt)
+            response = self.client.models.generate_content(
+                model=GEMINI_MODEL, contents=prompt, config=self.config
+            )
             return response.text.strip()
         except Exception as e:
             return f"Error generating message: {str(e)}"
 
+    def generate_batch(self, leads):
+        """Generate messages for all leads in a single Gemini batch job"""
+        inline_requests = [
+            {
+                "contents": [{"parts": [{"text": self.build_prompt(lead)}], "role": "user"}],
+                "config": self.batch_config,
+            }
+            for lead in leads
+        ]
+
+        try:
+            job = self.client.batches.create(
+                model=GEMINI_MODEL,
+                src=inline_requests,
+                config={"display_name": "reddit-tutor-leads"},
+            )
+            job = self.wait_for_batch(job)
+        except Exception as e:
+            print(f"⚠️  Batch generation failed ({str(e)}), falling back to one call per lead")
+            return self.generate_concurrently(leads)
+
+        # Inline responses come back in the same order as the requests
+        for lead, result in zip(leads, job.dest.inlined_responses):
+            # text is None when the candidate has no text part (safety block, MAX_TOKENS, ...)
+            text = result.response.text if result.response else None
+            if text:
+                lead['generated_message'] = text.strip()
+            else:
+                lead['generated_message'] = f"Error generating message: {result.error or 'response had no text'}"
+
+        return leads
+
+    def generate_concurrently(self, leads, max_workers=5):
+        """Generate messages with parallel per-lead calls, paced by the rate limiter"""
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(self.generate_personalized_message, lead): lead for lead in leads}
+            for future in as_completed(futures):
+                futures[future]['generated_message'] = future.result()
+
+        return leads
+
+    def wait_for_batch(self, job, timeout=900):
+        """Poll a batch job with exponential backoff until it finishes"""
+        delay = 5
+        deadline = time.monotonic() + timeout
+
+        while job.state.name not in BATCH_DONE_STATES:
+            if time.monotonic() > deadline:
+                self.client.batches.cancel(name=job.name)
+                raise TimeoutError(f"batch job did not finish within {timeout}s")
+            time.sleep(delay)
+            delay = min(delay * 2, 60)
+            job = self.client.batches.get(name=job.name)
+
+        if job.state.name != "JOB_STATE_SUCCEEDED":
+            raise RuntimeError(f"batch job ended with {job.state.name}")
+        return job
+
 # ==================== LEAD SCORING ====================
 
-def score_lead(lead):
-    """Score lead quality (1-10)"""
-    score = 5  # Base score
+# Category hits that raise a lead's score
+SCORE_DELTAS = {
+    "urgent": 2,   # Urgent posts score higher
+    "parent": 1,   # Parent posts often more serious
+    "payment": 1,  # Mentions payment = serious buyer
+}
+
+def num_comments_bonus(num_comments):
+    """More engagement = more visible post (but lower if too many comments = already getting help)"""
+    if 1 <= num_comments <= 5:
+        return 1
+    if num_comments > 10:
+        return -1  # Probably already found someone
+    return 0
 
-    # Urgent posts score higher
-    if lead['is_urgent']:
-        score += 2
+def score_lead(lead, hits):
+    """Score lead quality (1-10) from the keyword categories found in the post"""
+    score = 5  # Base score
+    score += sum(SCORE_DELTAS[category] for category in hits & SCORE_DELTAS.keys())
 
     # Posts with specific topics score higher
-    if len(lead['topics'].split(", ")) > 1:
+    if len(hits & TOPIC_KEYWORDS.keys()) > 1:
         score += 1
 
-    # Parent posts often more serious
-    if lead['is_parent']:
-        score += 1
+    score += num_comments_bonus(lead['num_comments'])
 
-    # Mentions payment = serious buyer
-    if lead['mentions_payment']:
-        score += 1
+    return min(max(score, 1), 10)
 
-    # More engagement = more visible post (but lower if too many comments = already getting help)
-    if 1 <= lead['num_comments'] <= 5:
-        score += 1
-    elif lead['num_comments'] > 10:
-        score -= 1  # Probably already found someone
+# ==================== PIPELINE ====================
 
-    return min(max(score, 1), 10)
+class MessagePipeline:
+    """Generates messages in Gemini batches while the scraper is still running"""
+
+    def __init__(self):
+        self.generator = None
+        self.messaged = []
+        self.jobs = []
+
+    async def dispatch(self, batch):
+        """Send a batch of leads to Gemini in the background"""
+        loop = asyncio.get_running_loop()
+        if self.generator is None:
+            print("🤖 Generating personalized messages with Gemini...\n")
+            self.generator = await loop.run_in_executor(None, GeminiMessageGenerator, GEMINI_API_KEY)
+
+        self.messaged.extend(batch)
+        self.jobs.append(loop.run_in_executor(None, self.generator.generate_batch, batch))
+
+    async def consume(self, queue):
+        """Batch high-priority leads as they arrive, then fill the budget with the best of the rest"""
+        loop = asyncio.get_running_loop()
+        pending = []
+        flush_at = None
+        others = []
+
+        while True:
+            # Don't hold eager leads back waiting for a full batch
+            timeout = max(flush_at - loop.time(), 0) if pending else None
+            try:
+                lead = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                await self.dispatch(pending)
+                pending = []
+                continue
+
+            if lead is None:
+                break
+
+            if lead['priority_score'] >= EAGER_PRIORITY and len(self.messaged) + len(pending) < MAX_MESSAGES:
+                if not pending:
+                    flush_at = loop.time() + EAGER_FLUSH_SECONDS
+                pending.append(lead)
+                if len(pending) == BATCH_SIZE:
+                    await self.dispatch(pending)
+                    pending = []
+            else:
+                others.append(lead)
+
+        # Scraping is done; top up the remaining message budget
+        remaining = MAX_MESSAGES - len(self.messaged) - len(pending)
+        final = pending + heapq.nlargest(remaining, others, key=operator.itemgetter('priority_score'))
+        if final:
+            await self.dispatch(final)
+
+        # Let every batch finish even if one of them fails
+        for result in await asyncio.gather(*self.jobs, return_exceptions=True):
+            if isinstance(result, Exception):
+                print(f"⚠️  Message generation failed: {str(result)}")
+
+async def find_and_generate(finder, pipeline, hours_back=24):
+    """Run the scraper (producer) and message generation (consumer) concurrently"""
+    queue = asyncio.Queue()
+
+    async def producer():
+        try:
+            async for lead in finder.search_posts(hours_back=hours_back):
+                await queue.put(lead)
+        finally:
+            await queue.put(None)
+
+    await asyncio.gather(producer(), pipeline.consume(queue))
 
 # ==================== MAIN EXECUTION ====================
 
@@ -282,30 +611,29 @@ def main():
         print("→ Copy .env.template to .env and fill in your credentials")
         return
 
-    # Step 1: Find leads
+    # Step 1: Find leads and generate messages as they come in
     finder = RedditLeadFinder()
-    leads = finder.search_posts(hours_back=24)
+    pipeline = MessagePipeline()
+    try:
+        asyncio.run(find_and_generate(finder, pipeline, hours_back=24))
+    except Exception as e:
+        # Still export and record whatever was scraped before the failure
+        print(f"⚠️  Run interrupted: {str(e)}")
+    leads = finder.leads
 
     if not leads:
+        finder.save_cursors()
         print("❌ No new leads found. Try:")
         print("   - Adjusting keywords or subreddits")
         print("   - Running during peak hours (evenings/weekends)")
         print("   - Increasing hours_back parameter")
         return
 
-    # Step 2: Score and sort leads
-    for lead in leads:
-        lead['priority_score'] = score_lead(lead)
-
-    leads.sort(key=lambda x: x['priority_score'], reverse=True)
+    # Step 2: Show the generated messages, best leads first
+    messaged = sorted(pipeline.messaged, key=operator.itemgetter('priority_score'), reverse=True)
+    num_to_process = len(messaged)
 
-    # Step 3: Generate personalized messages for top leads
-    print("🤖 Generating personalized messages with Gemini...\n")
-    generator = GeminiMessageGenerator(GEMINI_API_KEY)
-
-    num_to_process = min(len(leads), 15)  # Process top 15 leads
-
-    for i, lead in enumerate(leads[:num_to_process]):
+    for i, lead in enumerate(messaged):
         print(f"\n{'='*70}")
         print(f"LEAD #{i+1} | Priority Score: {lead['priority_score']}/10")
         print(f"{'='*70}")
@@ -319,28 +647,25 @@ def main():
         print(f"💰 Mentions Payment: {'Yes' if lead['mentions_payment'] else 'No'}")
         print()
 
-        message = generator.generate_personalized_message(lead)
-        lead['generated_message'] = message
-
         print("💬 GENERATED MESSAGE:")
         print("-" * 70)
-        print(message)
+        print(lead['generated_message'])
         print("-" * 70)
 
-        time.sleep(3)  # Rate limit Gemini API
-
-    # Step 4: Export to CSV
-    df = pd.DataFrame(leads)
+    # Step 3: Export to CSV (unsorted; sort by priority_score in your spreadsheet)
     timestamp = datetime.now().strftime('%Y%m%d_%H%M')
     output_file = f"reddit_leads_{timestamp}.csv"
-    df.to_csv(output_file, index=False)
+    with open(output_file, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=leads[0].keys())
+        writer.writeheader()
+        writer.writerows(leads)
 
-    # Update processed IDs file
-    all_processed = pd.DataFrame({'post_id': list(finder.processed_ids)})
-    all_processed.to_csv('processed_leads.csv', index=False)
+    # Record processed IDs
+    finder.save_processed_ids()
+    finder.save_cursors()
 
     print(f"\n✅ Lead data exported to: {output_file}")
-    print(f"✅ Processed IDs saved to: processed_leads.csv")
+    print(f"✅ Processed IDs saved to: {PROCESSED_DB}")
     print(f"\n{'='*70}")
     print("📋 SUMMARY")
     print(f"{'='*70}")